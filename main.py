@@ -5,15 +5,24 @@ Monitors multiple folders for new emails and uses an LLM to generate intelligent
 """
 
 import argparse
+import atexit
+import hashlib
+import html
 import json
 import os
+import re
 import smtplib
+import sqlite3
+import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from email.header import Header
+from email.message import EmailMessage
 from typing import Any, Optional
 
+import httpx
 from imap_tools import AND
 from imap_tools import MailBox
 from imap_tools import MailMessage
@@ -24,6 +33,13 @@ UTC = timezone.utc
 # Global configuration variable
 CONFIG: dict[str, Any] = {}
 
+# Share one HTTP connection pool across all LLM calls, with generous
+# keepalives, so repeated completions over hours of monitoring reuse the same
+# TCP+TLS session instead of paying a fresh handshake each time.
+litellm.client_session = httpx.Client(
+    limits=httpx.Limits(max_keepalive_connections=8, keepalive_expiry=300.0)
+)
+
 
 # Load configuration from JSON file
 def load_config(config_path: str = "config.json") -> dict[str, Any]:
@@ -35,24 +51,38 @@ def load_config(config_path: str = "config.json") -> dict[str, Any]:
         return json.load(f)
 
 
-def load_documentation(file_path: str, config_path: str) -> str:
-    """Load documentation content from file."""
-    # Make documentation file path relative to config file directory
-    config_dir = os.path.dirname(os.path.abspath(config_path))
-    doc_file_path = os.path.join(config_dir, file_path)
+# Documentation cache, keyed by absolute path. Each entry stores the file's
+# (mtime, size) fingerprint alongside its content so edits are picked up.
+_doc_cache: dict[str, tuple[tuple[int, int], str]] = {}
 
-    if os.path.exists(doc_file_path):
-        with open(doc_file_path, "r") as f:
-            return f.read()
-    else:
+
+def load_documentation(file_path: str) -> str:
+    """Load documentation content from file, caching unchanged files."""
+    # Documentation file paths are relative to the config file directory
+    doc_file_path = os.path.join(CONFIG["_config_dir"], file_path)
+
+    try:
+        file_stat = os.stat(doc_file_path)
+    except FileNotFoundError:
         return "Documentation file not found."
 
+    # Serve from cache if the file hasn't changed since the last read, so a
+    # busy folder doesn't re-read identical bytes for every incoming email.
+    fingerprint = (file_stat.st_mtime_ns, file_stat.st_size)
+    cached = _doc_cache.get(doc_file_path)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
+
+    with open(doc_file_path, "r") as f:
+        content = f.read()
+    _doc_cache[doc_file_path] = (fingerprint, content)
+    return content
+
 
-def load_state(config_path: str) -> dict[str, Any]:
+def load_state() -> dict[str, Any]:
     """Load the state file containing processed email UIDs and reply history."""
-    # Make state file path relative to config file directory
-    config_dir = os.path.dirname(os.path.abspath(config_path))
-    state_file_path = os.path.join(config_dir, CONFIG["state_file"])
+    # The state file path is relative to the config file directory
+    state_file_path = os.path.join(CONFIG["_config_dir"], CONFIG["state_file"])
 
     if os.path.exists(state_file_path):
         with open(state_file_path, "r") as f:
@@ -67,7 +97,9 @@ def load_state(config_path: str) -> dict[str, Any]:
             for folder in CONFIG["folders"]:
                 if folder not in state:
                     state[folder] = {
-                        "processed_uids": [],
+                        "uidvalidity": 0,
+                        "max_uid": 0,
+                        "skipped": [],
                         "failed_emails": [],
                         "retry_counts": {},
                     }
@@ -77,29 +109,201 @@ def load_state(config_path: str) -> dict[str, Any]:
                         state[folder]["failed_emails"] = []
                     if "retry_counts" not in state[folder]:
                         state[folder]["retry_counts"] = {}
+                    if "skipped" not in state[folder]:
+                        state[folder]["skipped"] = []
+                    if "uidvalidity" not in state[folder]:
+                        state[folder]["uidvalidity"] = 0
+                    if "max_uid" not in state[folder]:
+                        # Seed the watermark from older state files so the
+                        # first fetch after upgrading doesn't re-download the
+                        # whole folder.
+                        state[folder]["max_uid"] = max(
+                            (
+                                int(uid)
+                                for uid in state[folder].get("processed_uids", [])
+                            ),
+                            default=0,
+                        )
+                    # The watermark supersedes the old forever-growing list of
+                    # processed UIDs; drop it from migrated state files.
+                    state[folder].pop("processed_uids", None)
             return state
     # Initialize state for all folders with all required fields
     return {
         "replied_to_ids": [],
         **{
-            folder: {"processed_uids": [], "failed_emails": [], "retry_counts": {}}
+            folder: {
+                "uidvalidity": 0,
+                "max_uid": 0,
+                "skipped": [],
+                "failed_emails": [],
+                "retry_counts": {},
+            }
             for folder in CONFIG["folders"]
         },
     }
 
 
-def save_state(state: dict[str, Any], config_path: str) -> None:
+# Hash of the last state payload written, so unchanged state isn't rewritten.
+_last_state_hash: int | None = None
+
+# Guards every mutation of the shared state dict as well as the whole save
+# (serialization, temp-file write, and rename), so folder threads can't
+# resize a dict or list while another thread is iterating it, and two
+# threads can't fight over the same temp file.
+_state_lock = threading.Lock()
+
+
+def save_state(state: dict[str, Any]) -> None:
     """Save the state file with processed email UIDs and reply history."""
-    # Make state file path relative to config file directory
-    config_dir = os.path.dirname(os.path.abspath(config_path))
-    state_file_path = os.path.join(config_dir, CONFIG["state_file"])
+    global _last_state_hash
+
+    # The state file path is relative to the config file directory
+    state_file_path = os.path.join(CONFIG["_config_dir"], CONFIG["state_file"])
+
+    with _state_lock:
+        payload = json.dumps(state)
+        payload_hash = hash(payload)
+        if payload_hash == _last_state_hash:
+            return
+
+        # Write to a temp file and rename over the old one so a crash
+        # mid-write can't leave a truncated state file behind.
+        tmp_file_path = state_file_path + ".tmp"
+        with open(tmp_file_path, "w") as f:
+            f.write(payload)
+        os.replace(tmp_file_path, state_file_path)
+        _last_state_hash = payload_hash
+
+
+# Patterns for turning an HTML-only email into prompt-sized plain text.
+# Script/style blocks go first so their contents don't leak into the text.
+_html_block_re = re.compile(r"(?is)<(script|style).*?</\1>")
+_html_tag_re = re.compile(r"<[^>]+>")
+_quoted_line_re = re.compile(r"(?m)^>.*$")
+
+
+def prepare_email_body(msg: MailMessage) -> str:
+    """Return a trimmed plain-text body for the LLM prompt.
+
+    Large HTML emails (quoted threads, marketing footers, inline assets) can
+    run to hundreds of KB. Stripping markup, dropping quoted reply lines, and
+    capping the length keeps token counts, latency, and cost bounded.
+    """
+    body = msg.text or ""
+    if not body and msg.html:
+        body = _html_block_re.sub(" ", msg.html)
+        body = _html_tag_re.sub(" ", body)
+        body = html.unescape(body)
+
+    body = _quoted_line_re.sub("", body)
+    # Collapse the whitespace runs left behind by the stripping.
+    body = re.sub(r"\n{3,}", "\n\n", body)
+    body = re.sub(r"[ \t]{2,}", " ", body).strip()
+
+    max_chars = int(CONFIG.get("max_prompt_body_chars", 8000))
+    return body[:max_chars]
+
+
+# Collapse any existing stack of "Re:"/"Fwd:" prefixes before adding our own,
+# so long threads don't snowball into "Re: Re: Re: ..." Subject headers.
+_reply_prefix_re = re.compile(r"^(?:\s*(?:re|fwd?):\s*)+", re.IGNORECASE)
+
+
+def reply_subject(subject: str | None) -> str:
+    """Build the reply Subject without stacking repeated prefixes."""
+    return "Re: " + _reply_prefix_re.sub("", subject or "")
 
-    with open(state_file_path, "w") as f:
-        json.dump(state, f, indent=2)
+
+# Prompt templates. Everything invariant (the agent persona, the response
+# rules, the folder prompt, and the documentation) lives in the system
+# message, which is therefore stable across every email in a folder; that
+# prefix stability is what lets provider-side prompt caching kick in. Only
+# the user message varies per email.
+_SYSTEM_TEMPLATE = """You are a helpful customer support agent. Always be professional, empathetic, and solution-oriented.
+
+{custom_prompt}
+
+Write a helpful and professional response to the customer email. Make sure to:
+
+1. Address their specific questions or concerns.
+2. Provide clear and actionable information based on the documentation.
+3. Maintain a friendly and professional tone, but don't be condescending or saccharine.
+4. Include any relevant links or resources.
+5. Take the conversation history into account.
+6. Do not use em- or en-dashes. Use normal dashes.
+7. Don't sign emails.
+8. DO NOT assume things, and DO NOT say you have checked things you haven't. If you don't have access to check something, just don't assume or say anything about it. You MUST NEVER make implicit assumptions that might be wrong.
+
+Documentation:
+{documentation}
+"""
+
+_USER_TEMPLATE = """Customer Email:
+From: {from_}
+Subject: {subject}
+Message:
+```
+{body}
+```
+"""
+
+
+def cached_completion(kwargs: dict[str, Any]) -> str | None:
+    """Run an LLM completion, consulting a persistent response cache first.
+
+    Responses are cached in SQLite keyed by a hash of (model, messages), so
+    duplicate inbound emails (bounces, autoresponders, reissued tickets) skip
+    the network call and its cost entirely.
+    """
+    cache_key = hashlib.sha256(
+        json.dumps(
+            {"model": kwargs["model"], "messages": kwargs["messages"]},
+            sort_keys=True,
+        ).encode()
+    ).hexdigest()
+
+    cache_path = os.path.join(CONFIG["_config_dir"], "llm_cache.db")
+    with sqlite3.connect(cache_path) as db:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, body TEXT)"
+        )
+        row = db.execute(
+            "SELECT body FROM completions WHERE key = ?", (cache_key,)
+        ).fetchone()
+        if row:
+            return row[0]
+
+    # Stream the completion so tokens are shown as they're generated and the
+    # operator can start reading while the model is still writing. Only echo
+    # when replies are generated one at a time, though: concurrent folder
+    # threads would interleave fragments from different replies.
+    echo = CONFIG.get("_stream_replies", False)
+    response = litellm.completion(**kwargs, stream=True)
+    parts: list[str] = []
+    for chunk in response:
+        delta = chunk.choices[0].delta.content
+        if delta:
+            if echo:
+                sys.stdout.write(delta)
+                sys.stdout.flush()
+            parts.append(delta)
+    if echo:
+        sys.stdout.write("\n")
+    reply_body = "".join(parts) or None
+
+    if reply_body:
+        with sqlite3.connect(cache_path) as db:
+            db.execute(
+                "INSERT OR REPLACE INTO completions (key, body) VALUES (?, ?)",
+                (cache_key, reply_body),
+            )
+    return reply_body
 
 
 def generate_reply_content(
-    original_email: MailMessage, folder_name: str, config_path: str
+    original_email: MailMessage, folder_name: str
 ) -> dict[str, Optional[str]]:
     """
     Use an LLM to generate an intelligent support response.
@@ -107,63 +311,41 @@ def generate_reply_content(
     Args:
         original_email: MailMessage object from imap_tools
         folder_name: Name of the folder being processed
-        config_path: Path to the config file
 
     Returns:
         dict with 'subject', 'body', and optionally 'html' keys
     """
+    # Computed once and shared by the success and fallback paths.
+    subject = reply_subject(original_email.subject)
     try:
         # Get folder-specific configuration
         folder_config = CONFIG["folders"].get(folder_name, {})
         documentation_file = folder_config.get("documentation_file")
-        custom_prompt = folder_config.get("prompt", "")
+        # The prompt was formatted with the company info once at startup
+        custom_prompt = folder_config.get("_formatted_prompt", "")
 
         # Load documentation if available
         documentation = ""
         if documentation_file:
-            documentation = load_documentation(documentation_file, config_path)
+            documentation = load_documentation(documentation_file)
 
-        # Format the custom prompt with company info
-        custom_prompt = custom_prompt.format(
-            company_name=CONFIG.get("company_name", "Our Company"),
-            support_email=CONFIG.get("support_email", "support@company.com"),
+        # The system prompt is folder-stable; only the user message varies
+        # per email, keeping the cacheable prefix intact.
+        system_prompt = _SYSTEM_TEMPLATE.format(
+            custom_prompt=custom_prompt,
+            documentation=documentation,
+        )
+        prompt = _USER_TEMPLATE.format(
+            from_=original_email.from_,
+            subject=original_email.subject,
+            body=prepare_email_body(original_email),
         )
-
-        # Create the prompt for the LLM
-        prompt = f"""
-{custom_prompt}
-
-Documentation:
-{documentation}
-
-Customer Email:
-From: {original_email.from_}
-Subject: {original_email.subject}
-Message:
-```
-{original_email.text or original_email.html}
-```
-
-Please write a helpful and professional response to this customer email. Make sure to:
-
-1. Address their specific questions or concerns.
-2. Provide clear and actionable information based on the documentation.
-3. Maintain a friendly and professional tone, but don't be condescending or saccharine.
-4. Include any relevant links or resources.
-5. Take the conversation history into account.
-6. Do not use em- or en-dashes. Use normal dashes.
-7. Don't sign emails.
-8. DO NOT assume things, and DO NOT say you have checked things you haven't. If you don't have access to check something, just don't assume or say anything about it. You MUST NEVER make implicit assumptions that might be wrong.
-"""
 
         # Call LiteLLM API
         kwargs: dict[str, Any] = {
             "model": CONFIG["model"],
             "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a helpful customer support agent. Always be professional, empathetic, and solution-oriented.",
-                },
+                {"role": "system", "content": system_prompt},
                 {"role": "user", "content": prompt},
             ],
         }
@@ -183,13 +365,11 @@ Please write a helpful and professional response to this customer email. Make su
         if effort:
             kwargs["reasoning_effort"] = effort
 
-        response = litellm.completion(**kwargs)
-
-        # Extract the generated response
-        reply_body = response.choices[0].message.content
+        # Call the LLM, using the persistent cache for repeated inputs
+        reply_body = cached_completion(kwargs)
 
         return {
-            "subject": f"Re: {original_email.subject}",
+            "subject": subject,
             "body": reply_body,
             "html": None,  # You could convert to HTML if needed
         }
@@ -198,7 +378,7 @@ Please write a helpful and professional response to this customer email. Make su
         print(f"Error generating AI response: {str(e)}")
         # Fallback to a generic response if AI fails
         return {
-            "subject": f"Re: {original_email.subject}",
+            "subject": subject,
             "body": f"""Dear {original_email.from_},
 
 Thank you for contacting {CONFIG.get("company_name", "Our Company")} support.
@@ -219,13 +399,20 @@ def confirm_and_send_reply(
     original_email: MailMessage,
     reply_content: dict[str, Optional[str]],
     folder_name: str,
+    mailbox: MailBox,
     confirm: bool,
 ) -> bool:
     """Print the reply and ask for confirmation before sending if confirm flag is True."""
     # Check if send_emails is configured. If not present, default to dry-run mode.
     send_emails = CONFIG.get("send_emails", False)
 
-    if confirm:
+    # Headless batches shouldn't block on keyboard input: --auto-approve (or
+    # a folder's auto_approve option) skips the prompt even in confirm mode.
+    auto_approve = CONFIG.get("_auto_approve", False) or CONFIG["folders"].get(
+        folder_name, {}
+    ).get("auto_approve", False)
+
+    if confirm and not auto_approve:
         # Show the email and ask for confirmation
         print("\n" + "=" * 60)
         print("PROPOSED EMAIL RESPONSE:")
@@ -244,7 +431,7 @@ def confirm_and_send_reply(
             if response == "y":
                 if send_emails:
                     print("Sending...")
-                    send_reply(original_email, reply_content, folder_name)
+                    send_reply(original_email, reply_content, folder_name, mailbox)
                 else:
                     print("DRY RUN: Email would be sent (send_emails is false)")
                 return True
@@ -259,7 +446,7 @@ def confirm_and_send_reply(
             print(
                 f"\nSending reply to {original_email.from_} for: {original_email.subject}"
             )
-            send_reply(original_email, reply_content, folder_name)
+            send_reply(original_email, reply_content, folder_name, mailbox)
         else:
             # Dry run mode - just print the email
             print("\n" + "=" * 60)
@@ -276,82 +463,159 @@ def confirm_and_send_reply(
         return True
 
 
+# Lazily-initialized SMTP connection shared across replies, so a batch of
+# sends pays the TLS handshake and AUTH round-trip once instead of per email.
+# The lock serializes folder threads, since smtplib sessions aren't
+# thread-safe.
+_smtp: smtplib.SMTP | None = None
+_smtp_lock = threading.Lock()
+
+
+def get_smtp() -> smtplib.SMTP:
+    """Return a connected, authenticated SMTP session, reconnecting if stale."""
+    global _smtp
+
+    if _smtp is not None:
+        # Probe the existing connection; servers drop idle sessions.
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except (smtplib.SMTPException, OSError):
+            pass
+        try:
+            _smtp.close()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+    _smtp = smtplib.SMTP(CONFIG["smtp_server"], CONFIG["smtp_port"])
+    _smtp.starttls()
+    _smtp.login(CONFIG["email"], CONFIG["password"])
+    return _smtp
+
+
+def _close_smtp() -> None:
+    """Politely close the shared SMTP connection on exit."""
+    if _smtp is not None:
+        try:
+            _smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+
+
+atexit.register(_close_smtp)
+
+
 def send_reply(
     original_email: MailMessage,
     reply_content: dict[str, Optional[str]],
     folder_name: str,
+    mailbox: MailBox,
 ) -> None:
     """Send a reply to the original email with proper headers."""
-    # Create message
-    msg = MIMEMultipart("mixed")
-
-    # Set headers for proper threading
     subject = reply_content["subject"]
     assert subject is not None, "Reply subject cannot be None"
-    msg["Subject"] = subject
-    msg["From"] = CONFIG["email"]
-    msg["To"] = original_email.from_
-    msg["In-Reply-To"] = original_email.headers.get("message-id", [""])[0]
-    msg["References"] = original_email.headers.get("message-id", [""])[0]
-    msg["Date"] = datetime.now(UTC).strftime("%a, %d %b %Y %H:%M:%S +0000")
-    msg["Message-ID"] = f"<{datetime.now(UTC).timestamp()}.{CONFIG['email']}>"
-
-    # Add body
-    body = MIMEMultipart("alternative")
     body_text = reply_content["body"]
     assert body_text is not None, "Reply body cannot be None"
-    body.attach(MIMEText(body_text, "plain"))
-
     html_content = reply_content.get("html")
-    if html_content:
-        body.attach(MIMEText(html_content, "html"))
-
-    msg.attach(body)
 
-    # Send email
-    with smtplib.SMTP(CONFIG["smtp_server"], CONFIG["smtp_port"]) as server:
-        server.starttls()
-        server.login(CONFIG["email"], CONFIG["password"])
-        server.send_message(msg)
-
-    print(f"Reply sent to {original_email.from_} for: {original_email.subject}")
-
-    # Save to the same folder as the original message
+    # Headers for proper threading
+    to_address = original_email.from_
+    in_reply_to = original_email.headers.get("message-id", [""])[0]
+    date = datetime.now(UTC).strftime("%a, %d %b %Y %H:%M:%S +0000")
+    message_id = f"<{datetime.now(UTC).timestamp()}.{CONFIG['email']}>"
+
+    if html_content or not body_text.isascii():
+        # HTML replies need a multipart/alternative body, and non-ASCII text
+        # needs a transfer encoding the stdlib generator picks for us (we
+        # don't negotiate 8BITMIME), so both go through EmailMessage.
+        msg = EmailMessage()
+        msg["Subject"] = subject
+        msg["From"] = CONFIG["email"]
+        msg["To"] = to_address
+        msg["In-Reply-To"] = in_reply_to
+        msg["References"] = in_reply_to
+        msg["Date"] = date
+        msg["Message-ID"] = message_id
+        # Force quoted-printable: set_content would otherwise pick 8bit for
+        # non-ASCII text, which we can't send without negotiating 8BITMIME.
+        msg.set_content(body_text, cte="quoted-printable")
+        if html_content:
+            msg.add_alternative(html_content, subtype="html", cte="quoted-printable")
+        # sendmail() transmits bytes verbatim, so serialize with the CRLF
+        # line endings SMTP DATA requires.
+        raw_message = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))
+    else:
+        # Plain ASCII text is the common case: assemble the RFC 5322 bytes
+        # directly and skip the email generator machinery entirely. Only the
+        # Subject can carry non-ASCII that needs RFC 2047 encoding.
+        subject_value = (
+            subject if subject.isascii() else Header(subject, "utf-8").encode()
+        )
+        # The LLM emits bare LF newlines; sendmail() sends bytes verbatim, so
+        # normalize to the CRLF line endings SMTP DATA requires.
+        body_crlf = body_text.replace("\r\n", "\n").replace("\n", "\r\n")
+        raw_message = (
+            f"From: {CONFIG['email']}\r\n"
+            f"To: {to_address}\r\n"
+            f"Subject: {subject_value}\r\n"
+            f"In-Reply-To: {in_reply_to}\r\n"
+            f"References: {in_reply_to}\r\n"
+            f"Date: {date}\r\n"
+            f"Message-ID: {message_id}\r\n"
+            "MIME-Version: 1.0\r\n"
+            "Content-Type: text/plain; charset=utf-8\r\n"
+            "Content-Transfer-Encoding: 7bit\r\n"
+            "\r\n"
+            f"{body_crlf}"
+        ).encode("utf-8")
+
+    # Send email over the shared connection
+    with _smtp_lock:
+        server = get_smtp()
+        server.sendmail(CONFIG["email"], [to_address], raw_message)
+
+    print(f"Reply sent to {to_address} for: {original_email.subject}")
+
+    # Save to the same folder as the original message, reusing the already
+    # authenticated IMAP session instead of logging in again for every reply.
     try:
-        # Convert message to string for IMAP
-        msg_string = msg.as_string()
-
-        # Connect to IMAP to save the sent message
-        with MailBox(CONFIG["imap_server"]).login(
-            CONFIG["email"], CONFIG["password"]
-        ) as mailbox:
-            # Set the folder to the same as the original message
-            try:
-                mailbox.folder.set(folder_name)
-            except Exception as e:
-                print(f"Warning: Could not access folder '{folder_name}': {str(e)}")
-                return
-
-            # Append the message to the same folder as the original
-            # Use bytes and timezone-aware datetime to avoid compatibility issues
-            mailbox.append(
-                msg_string.encode(),
-                folder_name,
-                dt=datetime.now(UTC),
-                flag_set=["\\Seen"],
-            )
-            print(f"Reply saved to '{folder_name}' folder")
+        # Append the message to the same folder as the original
+        # Use bytes and timezone-aware datetime to avoid compatibility issues
+        mailbox.append(
+            raw_message,
+            folder_name,
+            dt=datetime.now(UTC),
+            flag_set=["\\Seen"],
+        )
+        print(f"Reply saved to '{folder_name}' folder")
 
     except Exception as e:
         print(f"Warning: Could not save to folder '{folder_name}': {str(e)}")
 
 
+def is_automated_email(msg: MailMessage) -> bool:
+    """Detect auto-replies, mailing-list mail, and bounces from their headers.
+
+    Covers the RFC 3834 Auto-Submitted marker, mailing-list headers, the
+    Exchange X-Auto-Response-Suppress header, and the conventional bounce
+    sender addresses. None of these should ever get a reply.
+    """
+    headers = msg.headers
+    if headers.get("auto-submitted", [""])[0].strip().lower().startswith("auto-"):
+        return True
+    if "list-id" in headers or "list-unsubscribe" in headers:
+        return True
+    if headers.get("x-auto-response-suppress"):
+        return True
+    sender = (msg.from_ or "").lower()
+    return sender.startswith(("mailer-daemon@", "postmaster@"))
+
+
 def process_new_emails(
     mailbox: MailBox,
     folder_name: str,
     folder_state: dict[str, Any],
     replied_to_state: list[str],
-    config_path: str,
     confirm: bool,
     debug: bool,
 ) -> tuple[int, bool]:
@@ -360,10 +624,49 @@ def process_new_emails(
     state_changed = False
     max_retries = 3  # Total of 3 attempts (initial + 2 retries)
 
-    # Fetch all emails once to avoid multiple IMAP fetches.
+    # UIDs are only stable within a UIDVALIDITY epoch; if the server reset
+    # it, the watermark and skipped UIDs refer to different messages and
+    # must be discarded.
+    try:
+        status = mailbox.folder.status(folder_name, ["UIDVALIDITY"])
+        uidvalidity = int(status.get("UIDVALIDITY") or 0)
+    except Exception:
+        uidvalidity = 0
+    if uidvalidity and uidvalidity != int(folder_state.get("uidvalidity") or 0):
+        with _state_lock:
+            if folder_state.get("uidvalidity"):
+                print(
+                    f"UIDVALIDITY changed for '{folder_name}'; resetting folder state."
+                )
+                folder_state["max_uid"] = 0
+                folder_state["skipped"] = []
+                folder_state["retry_counts"] = {}
+            folder_state["uidvalidity"] = uidvalidity
+        state_changed = True
+
+    previous_max_uid = int(folder_state.get("max_uid", 0))
+
+    def advance_watermark(uid: Any) -> None:
+        """Record that every message up to this UID has been settled."""
+        with _state_lock:
+            folder_state["max_uid"] = max(int(folder_state["max_uid"]), int(uid))
+
+    # Ask the server for only the messages we haven't settled yet: everything
+    # above the watermark, plus any older UIDs still pending a retry. UIDs are
+    # assigned monotonically within a folder, so "max_uid+1:*" covers all new
+    # mail. (Note that "N:*" always matches at least the highest-UID message,
+    # so the processed check below still guards against reprocessing it.)
+    pending_retry_uids = [
+        uid
+        for uid, count in folder_state["retry_counts"].items()
+        if count < max_retries
+    ]
+    fetch_uids = ",".join([*pending_retry_uids, f"{previous_max_uid + 1}:*"])
     if debug:
-        print(f"[debug] Fetching all messages in '{folder_name}'...")
-    all_emails = list(mailbox.fetch(AND(all=True)))
+        print(f"[debug] Fetching headers for UIDs {fetch_uids} in '{folder_name}'...")
+    # First pass: headers only. All the skip decisions below need nothing but
+    # headers, so full bodies are downloaded later just for the survivors.
+    all_emails = list(mailbox.fetch(AND(uid=fetch_uids), headers_only=True, bulk=True))
     sent_emails: list[MailMessage] = []
     sent_folders: list[str] = []
     sent_folder_value = CONFIG.get("sent_folders", CONFIG.get("sent_folder"))
@@ -399,10 +702,16 @@ def process_new_emails(
                 mailbox.folder.set(sent_folder)
                 if sent_since_date:
                     fetched = list(
-                        mailbox.fetch(AND(all=True, sent_date_gte=sent_since_date))
+                        mailbox.fetch(
+                            AND(all=True, sent_date_gte=sent_since_date),
+                            headers_only=True,
+                            bulk=True,
+                        )
                     )
                 else:
-                    fetched = list(mailbox.fetch(AND(all=True)))
+                    fetched = list(
+                        mailbox.fetch(AND(all=True), headers_only=True, bulk=True)
+                    )
                 sent_emails.extend(fetched)
                 if debug:
                     print(
@@ -460,18 +769,30 @@ def process_new_emails(
                     )
 
     if new_replied_to_ids:
-        replied_to_state.extend(sorted(new_replied_to_ids))
-        state_changed = True
+        with _state_lock:
+            # Re-check under the lock: another folder thread may have just
+            # recorded some of these IDs.
+            fresh_ids = sorted(new_replied_to_ids.difference(replied_to_state))
+            if fresh_ids:
+                replied_to_state.extend(fresh_ids)
+                state_changed = True
+
+    survivors: list[MailMessage] = []
 
     for msg in all_emails:
         uid_str = str(msg.uid)  # Convert to string for JSON serialization
 
-        # Check if we've already successfully processed this email
-        if msg.uid in folder_state["processed_uids"]:
+        # Anything at or below the watermark is settled unless it's still
+        # pending a retry. (The "N:*" fetch range always matches at least
+        # the highest-UID message, which is how settled ones reappear here.)
+        if (
+            int(msg.uid) <= previous_max_uid
+            and uid_str not in folder_state["retry_counts"]
+        ):
             if debug:
                 msg_id = msg.headers.get("message-id", [""])[0].strip()
                 print(
-                    "[debug] Already processed (state): "
+                    "[debug] Already settled (watermark): "
                     f"uid={msg.uid} message-id={msg_id or '<missing>'}"
                 )
             continue
@@ -484,6 +805,20 @@ def process_new_emails(
                     "[debug] Skipping bot-sent message: "
                     f"uid={msg.uid} message-id={msg_id or '<missing>'}"
                 )
+            advance_watermark(msg.uid)
+            continue
+
+        # Skip automated senders (auto-replies, list mail, bounces) before
+        # paying for a completion; these should never get a reply.
+        if is_automated_email(msg):
+            if debug:
+                msg_id = msg.headers.get("message-id", [""])[0].strip()
+                print(
+                    "[debug] Skipping automated message: "
+                    f"uid={msg.uid} message-id={msg_id or '<missing>'} "
+                    f"from={msg.from_ or '<missing>'}"
+                )
+            advance_watermark(msg.uid)
             continue
 
         msg_id = msg.headers.get("message-id", [""])[0]
@@ -509,10 +844,10 @@ def process_new_emails(
                     f"replies=[{reply_details or 'none'}]"
                 )
                 print(
-                    "[debug] Marking processed in state: "
+                    "[debug] Marking settled in state: "
                     f"uid={msg.uid} message-id={msg_id or '<missing>'}"
                 )
-            folder_state["processed_uids"].append(msg.uid)
+            advance_watermark(msg.uid)
             processed_count += 1
             continue
 
@@ -521,7 +856,41 @@ def process_new_emails(
 
         # Skip if we've exceeded max retries
         if retry_count >= max_retries:
+            advance_watermark(msg.uid)
+            continue
+
+        survivors.append(msg)
+
+    # Second pass: download full bodies only for the messages that made it
+    # through the header filters.
+    full_emails: dict[str, MailMessage] = {}
+    if survivors:
+        survivor_uids = ",".join(str(msg.uid) for msg in survivors)
+        if debug:
+            print(
+                f"[debug] Fetching bodies for UIDs {survivor_uids} in '{folder_name}'"
+            )
+        full_emails = {
+            str(msg.uid): msg
+            for msg in mailbox.fetch(AND(uid=survivor_uids), bulk=True)
+        }
+
+    for header_msg in survivors:
+        uid_str = str(header_msg.uid)
+        msg = full_emails.get(uid_str)
+        if msg is None:
+            # The message vanished between the header pass and the body
+            # fetch (deleted or moved by another client). Never reply off a
+            # bodyless header stub; leave the UID to the watermark/retry
+            # machinery and move on.
+            if debug:
+                print(
+                    "[debug] Body fetch returned nothing, skipping: "
+                    f"uid={header_msg.uid}"
+                )
             continue
+        msg_id = msg.headers.get("message-id", [""])[0]
+        retry_count = folder_state["retry_counts"].get(uid_str, 0)
 
         if debug:
             print(
@@ -540,26 +909,33 @@ def process_new_emails(
 
         try:
             # Generate reply content using folder-specific configuration
-            reply_content = generate_reply_content(msg, folder_name, config_path)
+            reply_content = generate_reply_content(msg, folder_name)
 
             # Send the reply with or without confirmation based on flag
-            confirm_and_send_reply(msg, reply_content, folder_name, confirm)
+            sent = confirm_and_send_reply(
+                msg, reply_content, folder_name, mailbox, confirm
+            )
 
-            # Mark as successfully processed
-            folder_state["processed_uids"].append(msg.uid)
+            # Mark as settled either way; operator-declined messages are
+            # remembered separately so they're never asked about again.
+            with _state_lock:
+                if not sent and int(msg.uid) not in folder_state["skipped"]:
+                    folder_state["skipped"].append(int(msg.uid))
+            advance_watermark(msg.uid)
             if debug:
                 print(
-                    "[debug] Added to processed_uids: "
-                    f"uid={msg.uid} message-id={msg_id or '<missing>'}"
+                    "[debug] Marked settled: "
+                    f"uid={msg.uid} message-id={msg_id or '<missing>'} sent={sent}"
                 )
             # Remove from retry counts if it was there
-            if uid_str in folder_state["retry_counts"]:
-                del folder_state["retry_counts"][uid_str]
+            with _state_lock:
+                folder_state["retry_counts"].pop(uid_str, None)
             processed_count += 1
 
         except Exception as e:
             # Increment retry count
-            folder_state["retry_counts"][uid_str] = retry_count + 1
+            with _state_lock:
+                folder_state["retry_counts"][uid_str] = retry_count + 1
 
             # Log detailed error information
             error_msg = (
@@ -574,32 +950,105 @@ def process_new_emails(
                 )
 
                 # Track failed emails in state
-                if "failed_emails" not in folder_state:
-                    folder_state["failed_emails"] = []
-
-                folder_state["failed_emails"].append(
-                    {
-                        "uid": msg.uid,
-                        "timestamp": datetime.now(UTC).isoformat(),
-                        "error": str(e),
-                        "subject": msg.subject,
-                        "from": msg.from_,
-                        "retry_count": max_retries,
-                    }
-                )
+                with _state_lock:
+                    if "failed_emails" not in folder_state:
+                        folder_state["failed_emails"] = []
+
+                    folder_state["failed_emails"].append(
+                        {
+                            "uid": msg.uid,
+                            "timestamp": datetime.now(UTC).isoformat(),
+                            "error": str(e),
+                            "subject": msg.subject,
+                            "from": msg.from_,
+                            "retry_count": max_retries,
+                        }
+                    )
+                advance_watermark(msg.uid)
             else:
                 remaining_retries = max_retries - folder_state["retry_counts"][uid_str]
                 print(f"  Will retry {remaining_retries} more time(s) in future runs.")
 
-    if processed_count > 0:
+    if processed_count > 0 or int(folder_state["max_uid"]) != previous_max_uid:
         state_changed = True
 
     return processed_count, state_changed
 
 
-def main(
-    config_path: str, confirm: bool, once: bool = False, debug: bool = False
+def scan_folder(
+    folder_name: str,
+    state: dict[str, Any],
+    confirm: bool,
+    debug: bool,
+) -> tuple[int, bool]:
+    """Open a dedicated IMAP connection for one folder and process its new emails.
+
+    IMAP SELECT is per-connection, so each folder gets its own connection; this
+    lets multiple folders be scanned concurrently without stepping on each
+    other's selected state.
+    """
+    try:
+        with MailBox(CONFIG["imap_server"]).login(
+            CONFIG["email"], CONFIG["password"]
+        ) as mailbox:
+            mailbox.folder.set(folder_name)
+            return process_new_emails(
+                mailbox,
+                folder_name,
+                state[folder_name],
+                state["replied_to_ids"],
+                confirm,
+                debug,
+            )
+    except Exception as e:
+        print(f"\nError processing folder '{folder_name}': {str(e)}")
+        return 0, False
+
+
+def monitor_folder(
+    folder_name: str,
+    state: dict[str, Any],
+    confirm: bool,
+    debug: bool,
 ) -> None:
+    """Watch one folder forever using IMAP IDLE.
+
+    The server pushes new-message notifications over a long-lived connection,
+    so quiet periods cost nothing and new mail is handled immediately instead
+    of up to check_interval later. Reconnects and falls back to a plain sleep
+    if the connection drops or the server doesn't support IDLE.
+    """
+    while True:
+        try:
+            with MailBox(CONFIG["imap_server"]).login(
+                CONFIG["email"], CONFIG["password"]
+            ) as mailbox:
+                mailbox.folder.set(folder_name)
+                while True:
+                    processed, state_changed = process_new_emails(
+                        mailbox,
+                        folder_name,
+                        state[folder_name],
+                        state["replied_to_ids"],
+                        confirm,
+                        debug,
+                    )
+                    if processed > 0:
+                        print(f"  Processed {processed} email(s) in '{folder_name}'")
+                    if state_changed:
+                        save_state(state)
+
+                    # RFC 2177 requires re-issuing IDLE at least every 29
+                    # minutes; waking up sooner also surfaces dead
+                    # connections earlier.
+                    mailbox.idle.wait(timeout=29 * 60)
+        except Exception as e:
+            print(f"\nError monitoring folder '{folder_name}': {str(e)}")
+            print("Will reconnect after the check interval...")
+            time.sleep(CONFIG["check_interval"])
+
+
+def main(confirm: bool, once: bool = False, debug: bool = False) -> None:
     """Main monitoring loop."""
 
     print("Starting AI-powered email support monitor...")
@@ -629,19 +1078,16 @@ def main(
     # Print folder prompts configuration
     print("\nFolder Prompts Configuration:")
     print("=" * 50)
-    company_name = CONFIG.get("company_name", "Our Company")
-    support_email = CONFIG.get("support_email", "support@company.com")
 
     for folder_name, folder_config in CONFIG["folders"].items():
         print(f"\nFolder: {folder_name}")
         print("-" * 30)
 
-        # Get and format the prompt
-        prompt_template = folder_config.get("prompt", "No prompt configured")
-        formatted_prompt = prompt_template.format(
-            company_name=company_name, support_email=support_email
+        # _formatted_prompt is always set (empty for folders without a
+        # prompt), so fall back on emptiness rather than absence.
+        formatted_prompt = (
+            folder_config.get("_formatted_prompt") or "No prompt configured"
         )
-
         print(f"Prompt: {formatted_prompt}")
 
         # Show documentation file if configured
@@ -651,51 +1097,66 @@ def main(
 
     print("\n" + "=" * 50)
 
-    state = load_state(config_path)
+    state = load_state()
+
+    # Continuous non-interactive monitoring uses IMAP IDLE: one long-lived
+    # thread per folder, woken by the server when new mail arrives, instead
+    # of polling every check_interval. Confirmation mode keeps the polling
+    # loop because interactive prompts can't interleave across threads, and
+    # --once wants exactly one pass.
+    if not (confirm or once):
+        threads = [
+            threading.Thread(
+                target=monitor_folder,
+                args=(folder_name, state, confirm, debug),
+                name=f"idle-{folder_name}",
+                daemon=True,
+            )
+            for folder_name in CONFIG["folders"]
+        ]
+        for thread in threads:
+            thread.start()
+        while True:
+            time.sleep(3600)
 
     while True:
         try:
-            # Connect to mailbox
-            with MailBox(CONFIG["imap_server"]).login(
-                CONFIG["email"], CONFIG["password"]
-            ) as mailbox:
-                total_processed = 0
-                any_state_changed = False
-
-                # Process each configured folder
-                for folder_name in CONFIG["folders"]:
-                    try:
-                        # Select folder
-                        mailbox.folder.set(folder_name)
-
-                        # Process new emails for this folder
-                        processed, state_changed = process_new_emails(
-                            mailbox,
-                            folder_name,
-                            state[folder_name],
-                            state["replied_to_ids"],
-                            config_path,
-                            confirm,
-                            debug,
+            total_processed = 0
+            any_state_changed = False
+            folder_names = list(CONFIG["folders"])
+
+            # Scan folders concurrently, one IMAP connection per folder, so
+            # total latency is bounded by the slowest folder rather than the
+            # sum. Confirmation mode stays sequential because interleaved
+            # interactive prompts from multiple folders would be unreadable.
+            if confirm or len(folder_names) == 1:
+                results = [
+                    scan_folder(folder_name, state, confirm, debug)
+                    for folder_name in folder_names
+                ]
+            else:
+                with ThreadPoolExecutor(max_workers=len(folder_names)) as executor:
+                    results = list(
+                        executor.map(
+                            lambda folder_name: scan_folder(
+                                folder_name, state, confirm, debug
+                            ),
+                            folder_names,
                         )
-                        total_processed += processed
-                        any_state_changed = any_state_changed or state_changed
-
-                        if processed > 0:
-                            print(
-                                f"  Processed {processed} email(s) in '{folder_name}'"
-                            )
+                    )
 
-                    except Exception as e:
-                        print(f"\nError processing folder '{folder_name}': {str(e)}")
-                        continue
+            for folder_name, (processed, state_changed) in zip(folder_names, results):
+                total_processed += processed
+                any_state_changed = any_state_changed or state_changed
+                if processed > 0:
+                    print(f"  Processed {processed} email(s) in '{folder_name}'")
 
-                if any_state_changed:
-                    save_state(state, config_path)
-                if total_processed > 0:
-                    print(
-                        f"\nTotal: Processed {total_processed} new email(s) across all folders"
-                    )
+            if any_state_changed:
+                save_state(state)
+            if total_processed > 0:
+                print(
+                    f"\nTotal: Processed {total_processed} new email(s) across all folders"
+                )
 
         except Exception as e:
             print(f"\nError: {str(e)}")
@@ -725,6 +1186,11 @@ if __name__ == "__main__":
         action="store_true",
         help="Ask for confirmation before sending each email (default: send without confirmation)",
     )
+    parser.add_argument(
+        "--auto-approve",
+        action="store_true",
+        help="Send replies without prompting even when --confirm is set",
+    )
     parser.add_argument(
         "--once",
         action="store_true",
@@ -739,9 +1205,23 @@ if __name__ == "__main__":
 
     # Load configuration with specified path
     CONFIG = load_config(args.config)
+    # Resolve the config directory once; every relative path (state file,
+    # documentation, caches) hangs off it.
+    CONFIG["_config_dir"] = os.path.dirname(os.path.abspath(args.config))
+    CONFIG["_auto_approve"] = args.auto_approve
+    # Replies are generated sequentially (and streaming output is readable)
+    # only with --confirm or a single monitored folder.
+    CONFIG["_stream_replies"] = args.confirm or len(CONFIG["folders"]) == 1
+    # The folder prompts only depend on static company info, so format them
+    # once here instead of for every email.
+    for folder_config in CONFIG["folders"].values():
+        folder_config["_formatted_prompt"] = folder_config.get("prompt", "").format(
+            company_name=CONFIG.get("company_name", "Our Company"),
+            support_email=CONFIG.get("support_email", "support@company.com"),
+        )
 
     try:
-        main(args.config, args.confirm, args.once, args.debug)
+        main(args.confirm, args.once, args.debug)
     except KeyboardInterrupt:
         print("\n\nMonitoring stopped by user.")
     except Exception as e: